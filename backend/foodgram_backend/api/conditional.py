@@ -0,0 +1,16 @@
+import hashlib
+
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    payload = ':'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(payload.encode()).hexdigest())
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -1,14 +1,125 @@
 import base64
+import binascii
+from io import BytesIO
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
 from rest_framework import serializers
 
+from app import renditions
+
+BASE64_SEPARATOR = ';base64,'
+BASE64_CHUNK_SIZE = 64 * 1024
+# base64.encodebytes и MIME переносят строки; пробелы в base64 не значимы.
+BASE64_WHITESPACE = ' \t\r\n'
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_image_format(header):
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def iter_base64_chunks(data, start):
+    """Режет base64 на куски без пробелов с длиной, кратной четырём."""
+    whitespace = str.maketrans('', '', BASE64_WHITESPACE)
+    rest = ''
+    for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+        chunk = rest + data[offset:offset + BASE64_CHUNK_SIZE].translate(
+            whitespace
+        )
+        end = len(chunk) - len(chunk) % 4
+        rest = chunk[end:]
+        if end:
+            yield chunk[:end]
+    if rest:
+        yield rest
+
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'invalid_base64': 'Некорректные данные изображения в base64.',
+        'unsupported_format': 'Неподдерживаемый формат изображения.',
+        'too_large': 'Размер изображения превышает {max_size} байт.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
 
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        start = data.find(BASE64_SEPARATOR)
+        if start == -1:
+            self.fail('invalid_base64')
+        start += len(BASE64_SEPARATOR)
+
+        length = len(data) - start - sum(
+            data.count(char, start) for char in BASE64_WHITESPACE
+        )
+        padding = data.rstrip(BASE64_WHITESPACE)[-2:].count('=')
+        size = length // 4 * 3 - padding
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if size > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        chunks = iter_base64_chunks(data, start)
+        try:
+            header = base64.b64decode(next(chunks, ''), validate=True)
+        except binascii.Error:
+            self.fail('invalid_base64')
+
+        image_format = sniff_image_format(header)
+        if image_format is None:
+            self.fail('unsupported_format')
+
+        name = 'temp.' + image_format
+        content_type = 'image/' + image_format
+        if size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = InMemoryUploadedFile(
+                BytesIO(), None, name, content_type, size, None
+            )
+        else:
+            file = TemporaryUploadedFile(name, content_type, size, None)
+
+        try:
+            file.write(header)
+            for chunk in chunks:
+                file.write(base64.b64decode(chunk, validate=True))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_base64')
+
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+
+class RenditionImageField(serializers.ImageField):
+    def __init__(self, rendition, **kwargs):
+        self.rendition = rendition
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+
+        rendition = self.context.get('image_rendition', self.rendition)
+        url = renditions.get_rendition_url(value, rendition)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
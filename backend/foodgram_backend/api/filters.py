@@ -8,12 +8,34 @@ class RecipeFilter(django_filters.FilterSet):
         field_name='author__id', lookup_expr='exact'
     )
     tags = django_filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
         to_field_name='slug',
-        lookup_expr='exact',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='filter_tags'
     )
+    tags_mode = django_filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_mode'
+    )
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
         fields = ('name', 'tags',)
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.with_tags(
+            sum(tag.mask for tag in value),
+            match_all=self.form.cleaned_data.get('tags_mode') == 'all'
+        )
+
+    @staticmethod
+    def filter_tags_mode(queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
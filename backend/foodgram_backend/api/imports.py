@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from api.serializers import RecipeSerializer
+from app import jobs, models, tasks, versions
+
+SAVE_ERROR = 'Не удалось сохранить рецепт.'
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_ingredient_ids(batch):
+    ingredient_ids = set()
+    for item in batch:
+        if not isinstance(item, dict):
+            continue
+        ingredients = item.get('ingredients')
+        if not isinstance(ingredients, list):
+            continue
+        for ingredient in ingredients:
+            try:
+                ingredient_ids.add(int(ingredient['id']))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return set(
+        models.Ingredient.objects
+        .filter(id__in=ingredient_ids)
+        .values_list('id', flat=True)
+    )
+
+
+@transaction.atomic
+def save_batch(author, batch):
+    recipes, recipe_ingredients, recipe_tags = [], [], []
+    for data in batch:
+        data = dict(data)
+        ingredients = data.pop('ingredients')
+        tags = data.pop('tags')
+        recipe = models.Recipe(
+            author=author, tags_mask=sum(tag.mask for tag in tags), **data
+        )
+        recipes.append(recipe)
+        recipe_ingredients.extend(
+            models.RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient['id'],
+                amount=ingredient['recipe_ingredient_amount']
+            )
+            for ingredient in ingredients
+        )
+        recipe_tags.extend(
+            models.RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        models.Recipe.objects.bulk_create(recipes)
+    else:
+        for recipe in recipes:
+            recipe.save()
+    models.RecipeIngredient.objects.bulk_create(
+        recipe_ingredients, batch_size=settings.RECIPE_IMPORT_BATCH_SIZE
+    )
+    models.RecipeTag.objects.bulk_create(
+        recipe_tags, batch_size=settings.RECIPE_IMPORT_BATCH_SIZE
+    )
+    jobs.enqueue_many(tasks.CREATE_RENDITIONS, (
+        {'image_name': name}
+        for name in dict.fromkeys(recipe.image.name for recipe in recipes)
+    ))
+    jobs.enqueue(
+        tasks.PUSH_TO_FEED, recipe_ids=[recipe.pk for recipe in recipes]
+    )
+    transaction.on_commit(lambda: versions.bump_version(versions.RECIPES))
+    return recipes
+
+
+def import_recipes(items, author, context=None, batch_size=None):
+    """Создаёт рецепты пачками, ошибки возвращаются по номеру записи."""
+    batch_size = batch_size or settings.RECIPE_IMPORT_BATCH_SIZE
+    tags = models.Tag.objects.in_bulk()
+    created, errors = [], []
+    offset = 0
+
+    for batch in iter_batches(items, batch_size):
+        batch_context = {
+            **(context or {}),
+            'tags': tags,
+            'ingredient_ids': get_ingredient_ids(batch),
+        }
+        valid, indexes = [], []
+        for index, item in enumerate(batch, start=offset):
+            serializer = RecipeSerializer(data=item, context=batch_context)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+                indexes.append(index)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        offset += len(batch)
+        if not valid:
+            continue
+
+        try:
+            recipes = save_batch(author, valid)
+        except DatabaseError:
+            errors.extend(
+                {'index': index, 'errors': {'non_field_errors': [SAVE_ERROR]}}
+                for index in indexes
+            )
+        else:
+            created.extend(recipe.pk for recipe in recipes)
+        finally:
+            for data in valid:
+                data['image'].close()
+
+    errors.sort(key=lambda error: error['index'])
+    return {'created': created, 'errors': errors}
@@ -1,9 +1,15 @@
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from rest_framework import status, permissions
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from api.conditional import make_etag, set_validators
 from api.serializers import ShortenedRecipeReadSerializer
-from app import models
+from app import models, versions
+
+catalog_payloads = {}
 
 
 class AddToCollectionMixin:
@@ -47,3 +53,37 @@ class AddToCollectionMixin:
                 {'errors': 'Рецепт не находится в коллекции'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+
+class CatalogCacheMixin:
+    catalog_version = None
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, JSONRenderer):
+            return super().list(request, *args, **kwargs)
+
+        version = versions.get_version(self.catalog_version)
+        etag = make_etag(
+            self.catalog_version, version, request.accepted_media_type
+        )
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        key = (self.catalog_version, request.accepted_media_type)
+        cached_version, content = catalog_payloads.get(key, (None, None))
+
+        if cached_version != version:
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            content = renderer.render(
+                serializer.data,
+                request.accepted_media_type,
+                self.get_renderer_context()
+            )
+            catalog_payloads[key] = (version, content)
+
+        response = HttpResponse(
+            content, content_type=request.accepted_media_type
+        )
+        return set_validators(response, etag=etag)
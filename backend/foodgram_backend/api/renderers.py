@@ -0,0 +1,47 @@
+from django.utils.encoding import force_str
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Список отдаётся готовыми байтами, через рендерер идут только ошибки.
+
+    Ошибка — это текст, поэтому и тип ответа у неё ``text/plain``.
+    """
+    charset = 'utf-8'
+    error_content_type = 'text/plain; charset=utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = self.error_content_type
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return force_str(data).encode('utf-8')
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListJSONRenderer(JSONRenderer):
+    format = 'json'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListPDFRenderer,
+)
@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
 
-from api.fields import Base64ImageField
-from app import models, validators
+from api.fields import Base64ImageField, RenditionImageField
+from app import cart, jobs, models, tasks, validators
 
 User = get_user_model()
 
@@ -23,6 +24,9 @@ class IsSubUserSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+
         user = self.context['request'].user
         if user.is_authenticated:
             return models.FollowAuthor.objects.filter(
@@ -88,7 +92,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image_rendition = 'detail'
+    image = RenditionImageField(rendition=image_rendition)
 
     class Meta:
         model = models.Recipe
@@ -107,20 +112,39 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+
         user = self.context['request'].user
         return user.is_authenticated and models.FavoriteRecipe.objects.filter(
             user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+
         user = self.context['request'].user
         return (user.is_authenticated
                 and models.ShoppingCartRecipe.objects.filter(
                     user=user, recipe=obj
                 ).exists())
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
+
+class PantryRecipeSerializer(RecipeReadSerializer):
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('coverage',)
+        read_only_fields = fields
+
 
 class ShortenedRecipeReadSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    image = RenditionImageField(rendition='card')
 
     class Meta:
         model = models.Recipe
@@ -134,9 +158,8 @@ class ShortenedRecipeReadSerializer(serializers.ModelSerializer):
 
 
 class RecipeSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=models.Tag.objects.all(),
-        many=True,
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
         allow_empty=False,
     )
     ingredients = IngredientRecipeSerializer(
@@ -159,13 +182,59 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('author',)
 
-    @staticmethod
-    def validate_ingredients(value):
+    def save(self, **kwargs):
+        creating = self.instance is None
+        image = self.validated_data.get('image')
+        try:
+            with transaction.atomic():
+                recipe = super().save(**kwargs)
+                if image is not None:
+                    jobs.enqueue(
+                        tasks.CREATE_RENDITIONS, image_name=recipe.image.name
+                    )
+                if creating:
+                    jobs.enqueue(tasks.PUSH_TO_FEED, recipe_ids=[recipe.pk])
+        finally:
+            if image is not None:
+                image.close()
+        return recipe
+
+    def validate_tags(self, value):
+        if len(value) != len(set(value)):
+            raise serializers.ValidationError('Теги не должны повторяться')
+
+        tags = self.context.get('tags')
+        if tags is None:
+            tags = models.Tag.objects.in_bulk(value)
+        missing = [str(tag_id) for tag_id in value if tag_id not in tags]
+        if missing:
+            raise serializers.ValidationError(
+                f'Теги не найдены: {", ".join(missing)}'
+            )
+        return [tags[tag_id] for tag_id in value]
+
+    def validate_ingredients(self, value):
         ingredient_ids = [ingredient['id'] for ingredient in value]
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError(
                 'Ингредиенты не должны повторяться'
             )
+
+        existing = self.context.get('ingredient_ids')
+        if existing is None:
+            existing = set(
+                models.Ingredient.objects
+                .filter(id__in=ingredient_ids)
+                .values_list('id', flat=True)
+            )
+        missing = [
+            str(ingredient_id) for ingredient_id in ingredient_ids
+            if ingredient_id not in existing
+        ]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}'
+            )
         return value
 
     @staticmethod
@@ -190,37 +259,112 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         models.RecipeTag.objects.bulk_create(recipe_tags)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
 
-        recipe = models.Recipe.objects.create(**validated_data)
+        recipe = models.Recipe.objects.create(
+            **validated_data, tags_mask=sum(tag.mask for tag in tags)
+        )
 
         self.create_ingredients(recipe, ingredients)
         self.create_tags(recipe, tags)
 
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients_data):
+        amounts = {
+            ingredient['id']: ingredient['recipe_ingredient_amount']
+            for ingredient in ingredients_data
+        }
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in models.RecipeIngredient.objects.filter(
+                recipe=recipe
+            )
+        }
+        # Удалённые строки списывает из корзин QuerySet.delete, здесь
+        # остаются только строки, которые пишутся bulk-запросами.
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in existing.items()
+            if ingredient_id in amounts
+        }
+
+        to_create = [
+            models.RecipeIngredient(
+                ingredient_id=ingredient_id, recipe=recipe, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        to_update, to_delete = [], []
+        for ingredient_id, recipe_ingredient in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is None:
+                to_delete.append(recipe_ingredient.pk)
+            elif amount != recipe_ingredient.amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+
+        models.RecipeIngredient.objects.bulk_create(to_create)
+        models.RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        if to_delete:
+            models.RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+
+        return old_amounts, amounts
+
+    @classmethod
+    def update_tags(cls, recipe, tags_data):
+        old_ids = set(
+            models.RecipeTag.objects
+            .filter(recipe=recipe)
+            .values_list('tag_id', flat=True)
+        )
+        new_ids = {tag.id for tag in tags_data}
+
+        cls.create_tags(
+            recipe, [tag for tag in tags_data if tag.id not in old_ids]
+        )
+        if old_ids - new_ids:
+            models.RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=old_ids - new_ids
+            ).delete()
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
 
+        if tags is not None:
+            instance.tags_mask = sum(tag.mask for tag in tags)
         super().update(instance, validated_data)
 
-        instance.recipe_ingredient.all().delete()
-        instance.recipe_tag.all().delete()
-
-        self.create_ingredients(instance, ingredients)
-        self.create_tags(instance, tags)
+        if ingredients is not None:
+            old_amounts, new_amounts = self.update_ingredients(
+                instance, ingredients
+            )
+            cart.change_recipe(instance.pk, old_amounts, new_amounts)
+        if tags is not None:
+            self.update_tags(instance, tags)
 
         return instance
 
     def to_representation(self, instance):
+        instance = (
+            models.Recipe.objects
+            .for_read()
+            .with_user_flags(self.context['request'].user)
+            .get(pk=instance.pk)
+        )
         return RecipeReadSerializer(instance, context=self.context).data
 
 
 class UserRecipeSerializer(IsSubUserSerializer, serializers.ModelSerializer):
     recipes_count = serializers.SerializerMethodField()
+    recipes = serializers.SerializerMethodField()
 
     class Meta(IsSubUserSerializer.Meta):
         fields = IsSubUserSerializer.Meta.fields + (
@@ -228,16 +372,31 @@ class UserRecipeSerializer(IsSubUserSerializer, serializers.ModelSerializer):
             'recipes'
         )
 
+    @staticmethod
+    def get_recipes_limit(request):
+        try:
+            limit = int(request.query_params.get('recipes_limit', 3))
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise serializers.ValidationError({
+                'recipes_limit': 'Должно быть неотрицательным целым числом.'
+            })
+        return limit
+
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+
         count = obj.recipes.count()
         return count
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        max_recipes = int(self.context['request'].query_params.get(
-            'recipes_limit', 3))
-        recipes = instance.recipes.all()[:max_recipes]
-        serialized_recipes = ShortenedRecipeReadSerializer(
-            recipes, many=True).data
-        data['recipes'] = serialized_recipes
-        return data
+    def get_recipes(self, obj):
+        if hasattr(obj, 'first_recipes'):
+            recipes = obj.first_recipes
+        else:
+            max_recipes = self.get_recipes_limit(self.context['request'])
+            recipes = obj.recipes.all()[:max_recipes]
+        return ShortenedRecipeReadSerializer(
+            recipes, many=True, context=self.context
+        ).data
@@ -0,0 +1,167 @@
+import csv
+import json
+from io import BytesIO
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from app import models, versions
+
+PDF_FONT_NAME = 'ShoppingList'
+PDF_FONT_SIZE = 12
+PDF_LEADING = 16
+PDF_MARGIN = 50
+
+
+def get_shopping_list(user):
+    return (
+        models.ShoppingListItem.objects
+        .filter(user=user)
+        .values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        )
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+    )
+
+
+def iter_shopping_list(user):
+    rows = get_shopping_list(user).iterator()
+    first = next(rows, None)
+    if first is None:
+        return None
+    return chain((first,), rows)
+
+
+def iter_lines(rows):
+    yield 'Список покупок:'
+    yield ''
+    for ingredient_name, measurement_unit, amount in rows:
+        yield f'{ingredient_name} — {amount} {measurement_unit}'
+
+
+def render_text(rows):
+    for line in iter_lines(rows):
+        yield line + '\n'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield '﻿' + writer.writerow(
+        ('Ингредиент', 'Количество', 'Единица измерения')
+    )
+    for ingredient_name, measurement_unit, amount in rows:
+        yield writer.writerow((ingredient_name, amount, measurement_unit))
+
+
+def render_json(rows):
+    separator = '['
+    for ingredient_name, measurement_unit, amount in rows:
+        yield separator + json.dumps({
+            'name': ingredient_name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+def register_pdf_font():
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT)
+        )
+
+
+def wrap_lines(lines, width):
+    for line in lines:
+        parts = simpleSplit(line, PDF_FONT_NAME, PDF_FONT_SIZE, width)
+        yield from parts or ['']
+
+
+def render_pdf(rows):
+    # Подмножество шрифта зависит от всех страниц сразу, поэтому документ
+    # собирается целиком и отдаётся одним куском.
+    register_pdf_font()
+    buffer = BytesIO()
+    pdf = canvas.Canvas(
+        buffer,
+        pagesize=A4,
+        initialFontName=PDF_FONT_NAME,
+        initialFontSize=PDF_FONT_SIZE,
+        initialLeading=PDF_LEADING
+    )
+    width, height = A4
+    text = None
+    for line in wrap_lines(iter_lines(rows), width - 2 * PDF_MARGIN):
+        if text is None or text.getY() < PDF_MARGIN:
+            if text is not None:
+                pdf.drawText(text)
+                pdf.showPage()
+            text = pdf.beginText(PDF_MARGIN, height - PDF_MARGIN)
+        text.textLine(line)
+    pdf.drawText(text)
+    pdf.save()
+    yield buffer.getvalue()
+
+
+WRITERS = {
+    'txt': render_text,
+    'csv': render_csv,
+    'json': render_json,
+    'pdf': render_pdf,
+}
+
+
+def get_cache_key(user, format):
+    return f'shopping-list:{user.id}:{format}'
+
+
+def get_cache_version(user):
+    return versions.get_versions(
+        versions.cart(user.id),
+        versions.SHOPPING_LISTS,
+        versions.INGREDIENTS
+    )
+
+
+def get_cached(user, format, version):
+    cached_version, content = cache.get(
+        get_cache_key(user, format), (None, None)
+    )
+    if cached_version != version:
+        return None
+    return content
+
+
+def stream_and_cache(user, format, rows, version):
+    # Версию читают до выборки строк: изменение, пришедшее между ними,
+    # сбросит кэш, а не останется в нём под новой версией.
+    key = get_cache_key(user, format)
+    parts, size = [], 0
+    for chunk in WRITERS[format](rows):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if parts is not None:
+            size += len(chunk)
+            parts.append(chunk)
+            if size > settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+                parts = None
+        yield chunk
+
+    if parts is not None:
+        cache.set(
+            key,
+            (version, b''.join(parts)),
+            settings.SHOPPING_LIST_CACHE_TIMEOUT
+        )
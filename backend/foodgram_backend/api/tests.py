@@ -0,0 +1,422 @@
+import base64
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from PIL import Image
+from reportlab.pdfbase import pdfmetrics
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api import fields, shopping_list
+from app import cart, models, renditions, tasks, versions
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class APITestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.breakfast = models.Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.lunch = models.Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        cls.ingredients = [
+            models.Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(30)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.anonymous = APIClient()
+
+    @classmethod
+    def create_recipe(cls, author=None, ingredients=None, tags=None,
+                      name='Рецепт'):
+        tags = [cls.breakfast] if tags is None else tags
+        recipe = models.Recipe.objects.create(
+            author=author or cls.author,
+            name=name,
+            text='Описание',
+            cooking_time=10,
+            image='recipes/images/recipe.png',
+            tags_mask=sum(tag.mask for tag in tags),
+        )
+        models.RecipeIngredient.objects.bulk_create(
+            models.RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient, amount in (ingredients or {}).items()
+        )
+        models.RecipeTag.objects.bulk_create(
+            models.RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        return recipe
+
+    def get_ids(self, response):
+        return [recipe['id'] for recipe in response.json()['results']]
+
+
+class RecipeQueryCountTests(APITestCase):
+    # На PostgreSQL перед COUNT читается оценка числа строк из pg_class.
+    list_queries = 4 + (connection.vendor == 'postgresql')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        amounts = {ingredient: 100 for ingredient in cls.ingredients}
+        for index in range(6):
+            cls.create_recipe(
+                ingredients=amounts,
+                tags=[cls.breakfast, cls.lunch],
+                name=f'Рецепт {index}'
+            )
+
+    def test_list_page_query_count(self):
+        # COUNT, рецепты, теги, строки ингредиентов.
+        with self.assertNumQueries(self.list_queries):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(
+            len(recipe['ingredients']) == 30 for recipe in results
+        ))
+
+    def test_anonymous_list_page_query_count(self):
+        with self.assertNumQueries(self.list_queries):
+            response = self.anonymous.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_query_count(self):
+        recipe = models.Recipe.objects.first()
+        # Валидаторы ETag, рецепт, теги, строки ингредиентов.
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['ingredients']), 30)
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(8):
+            cls.create_recipe(name=f'Рецепт {index}')
+        cls.ordered_ids = list(
+            models.Recipe.objects
+            .order_by('created', 'id')
+            .values_list('id', flat=True)
+        )
+
+    def test_walks_all_pages_forward_and_back(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=3')
+        pages = [self.get_ids(response)]
+        self.assertIsNone(response.json()['previous'])
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            pages.append(self.get_ids(response))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual(sum(pages, []), self.ordered_ids)
+
+        response = self.client.get(response.json()['previous'])
+        self.assertEqual(self.get_ids(response), pages[1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=bm90LWpzb24')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_limit_falls_back_to_page_size(self):
+        for limit in ('0', '-1', 'abc'):
+            response = self.client.get(f'/api/recipes/?cursor=&limit={limit}')
+            self.assertEqual(len(self.get_ids(response)), 6)
+
+    def test_cursor_with_search_is_rejected(self):
+        response = self.client.get('/api/recipes/?cursor=&search=Рецепт')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+
+
+class RecipeValidatorsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(
+            ingredients={self.ingredients[0]: 10}
+        )
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.get_etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_author_change_invalidates_etag(self):
+        etag = self.get_etag()
+        self.author.first_name = 'Павел'
+        self.author.save()
+        self.assertNotEqual(self.get_etag(), etag)
+
+    def test_rendition_invalidates_etag(self):
+        etag = self.get_etag()
+        name = renditions.get_rendition_name(self.recipe.image.name, 'detail')
+        default_storage.save(name, ContentFile(b'webp'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['image'].endswith('.webp'))
+
+    def test_ingredient_line_change_invalidates_etag(self):
+        etag = self.get_etag()
+        line = self.recipe.recipe_ingredient.get()
+        line.amount = 20
+        line.save()
+        self.assertNotEqual(self.get_etag(), etag)
+        line.delete()
+        self.assertNotEqual(self.get_etag(), etag)
+
+
+class ShoppingCartTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+        self.recipe = self.create_recipe(ingredients={
+            self.ingredients[0]: 100, self.ingredients[1]: 200
+        })
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def get_totals(self):
+        return dict(
+            models.ShoppingListItem.objects
+            .filter(user=self.user)
+            .values_list('ingredient_id', 'amount')
+        )
+
+    def test_recipe_update_applies_deltas(self):
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 150},
+                {'id': self.ingredients[2].id, 'amount': 5},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_totals(), {
+            self.ingredients[0].id: 150, self.ingredients[2].id: 5
+        })
+        self.assertEqual(cart.find_mismatches(), [])
+
+    def test_remove_from_cart(self):
+        response = self.client.delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_totals(), {})
+
+    def test_recipe_delete_empties_download(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author_client.delete(
+                f'/api/recipes/{self.recipe.id}/'
+            )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_totals(), {})
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_change_during_download_is_not_cached(self):
+        iter_shopping_list = shopping_list.iter_shopping_list
+
+        def iter_and_change(user):
+            rows = iter_shopping_list(user)
+            # Изменение корзины фиксируется после выборки строк.
+            versions.bump_version(versions.cart(user.id))
+            return rows
+
+        with mock.patch(
+            'api.shopping_list.iter_shopping_list', iter_and_change
+        ):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/?format=txt'
+            )
+            b''.join(response.streaming_content)
+
+        self.assertIsNone(shopping_list.get_cached(
+            self.user, 'txt', shopping_list.get_cache_version(self.user)
+        ))
+
+
+class ShoppingListPDFTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = ' '.join(['Ёжевичный «джем» № 5'] * 9)
+        recipe = self.create_recipe(ingredients={
+            models.Ingredient.objects.create(
+                name=self.name, measurement_unit='г'
+            ): 100
+        })
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+
+    def test_embeds_font(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=pdf'
+        )
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertIn(b'/FontFile2', content)
+        self.assertNotIn(b'/Helvetica', content)
+
+    def test_wraps_long_lines(self):
+        shopping_list.register_pdf_font()
+        width = 300
+        line = f'{self.name} — 100 г'
+        parts = list(shopping_list.wrap_lines([line], width))
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(' '.join(parts), line)
+        for part in parts:
+            self.assertLessEqual(
+                pdfmetrics.stringWidth(
+                    part,
+                    shopping_list.PDF_FONT_NAME,
+                    shopping_list.PDF_FONT_SIZE
+                ),
+                width
+            )
+
+
+class ShoppingListErrorTests(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def test_unauthorized_json(self):
+        response = self.anonymous.get(self.url + '?format=json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+
+    def test_unauthorized_pdf(self):
+        response = self.anonymous.get(self.url + '?format=pdf')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; charset=utf-8'
+        )
+        self.assertTrue(response.content.decode())
+
+    def test_empty_cart(self):
+        response = self.client.get(self.url + '?format=json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            response.json(), {'detail': 'У вас нет рецептов в корзине'}
+        )
+
+        response = self.client.get(self.url + '?format=csv')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; charset=utf-8'
+        )
+        self.assertEqual(
+            response.content.decode(), 'У вас нет рецептов в корзине'
+        )
+
+
+class Base64ImageFieldTests(TestCase):
+    def test_decodes_wrapped_base64(self):
+        buffer = BytesIO()
+        Image.frombytes('RGB', (200, 200), os.urandom(200 * 200 * 3)).save(
+            buffer, 'PNG'
+        )
+        image = buffer.getvalue()
+        self.assertGreater(len(image), fields.BASE64_CHUNK_SIZE)
+        encoded = base64.encodebytes(image).decode()
+
+        file = fields.Base64ImageField().decode(
+            f'data:image/png;base64,{encoded}'
+        )
+        self.assertEqual(file.size, len(image))
+        self.assertEqual(file.read(), image)
+
+    def test_rejects_non_base64_characters(self):
+        field = fields.Base64ImageField()
+        with self.assertRaises(ValidationError) as context:
+            field.decode('data:image/png;base64,iVBORw0KGgo*AAAAA')
+        self.assertEqual(context.exception.get_codes(), ['invalid_base64'])
+
+
+class RecipeJobsTests(APITestCase):
+    def get_payload(self):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), (255, 0, 0)).save(buffer, 'PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        return {
+            'tags': [self.breakfast.id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 10}],
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': f'data:image/png;base64,{image}',
+        }
+
+    def test_create_enqueues_jobs(self):
+        response = self.client.post(
+            '/api/recipes/', self.get_payload(), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(models.Job.objects.values_list('kind', flat=True)),
+            sorted([tasks.CREATE_RENDITIONS, tasks.PUSH_TO_FEED])
+        )
+
+    def test_enqueue_failure_rolls_back_recipe(self):
+        with mock.patch(
+            'app.jobs.enqueue', side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            self.client.post(
+                '/api/recipes/', self.get_payload(), format='json'
+            )
+        self.assertFalse(models.Recipe.objects.exists())
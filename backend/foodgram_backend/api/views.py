@@ -1,21 +1,35 @@
 from collections import defaultdict
+from itertools import islice
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q, Sum
-from django.http import HttpResponse
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+from django.db.models import BooleanField, Count, F, Value
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response,
+                                patch_vary_headers)
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api import serializers
+from api import imports, serializers, shopping_list
+from api.conditional import make_etag, set_validators
 from api.filters import RecipeFilter
-from api.mixins import AddToCollectionMixin
+from api.mixins import AddToCollectionMixin, CatalogCacheMixin
+from api.parsers import NDJSONParser
 from api.permissions import IsAuthorOrReadOnly
-from app import models
+from api.renderers import SHOPPING_LIST_RENDERERS
+from app import feed, jobs, models, renditions, tasks, versions
+from app.indexes import ingredient_index, pantry_index
+from foodgram_backend.pagination import (CursorOrPageNumberPagination,
+                                         FeedPagination, KeysetPagination,
+                                         parse_positive_int)
 
 User = get_user_model()
 
@@ -39,9 +53,29 @@ class NewUserViewSet(UserViewSet):
     )
     def subscriptions(self, request, *args, **kwargs):
         user = request.user
-        subscribed_users = User.objects.filter(following__user=user)
+        recipes_limit = serializers.UserRecipeSerializer.get_recipes_limit(
+            request
+        )
+        subscribed_users = (
+            User.objects
+            .filter(following__user=user)
+            .annotate(
+                recipes_count=Count('recipes'),
+                is_subscribed=Value(True, output_field=BooleanField()),
+            )
+            .order_by(*User._meta.ordering)
+        )
 
         page = self.paginate_queryset(subscribed_users)
+        first_recipes = defaultdict(list)
+        if page and recipes_limit:
+            for recipe in models.Recipe.objects.first_per_author(
+                [author.id for author in page], recipes_limit
+            ):
+                first_recipes[recipe.author_id].append(recipe)
+        for author in page:
+            author.first_recipes = first_recipes[author.id]
+
         serializer = serializers.UserRecipeSerializer(
             page, many=True,
             context={'request': request}
@@ -49,32 +83,63 @@ class NewUserViewSet(UserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_version = versions.TAGS
     pagination_class = None
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_version = versions.INGREDIENTS
     pagination_class = None
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        term = self.request.query_params.get('name', '').strip()
+    def list(self, request, *args, **kwargs):
+        term = request.query_params.get('name', '').strip()
 
-        if term:
-            queryset = queryset.filter(
-                Q(name__istartswith=term) | Q(name__icontains=term)
+        if not term:
+            return super().list(request, *args, **kwargs)
+
+        if request.query_params.get('fuzzy') == '1':
+            ingredients = self.fuzzy_search(term)
+        else:
+            ingredients = ingredient_index.search(
+                term, settings.INGREDIENT_SEARCH_LIMIT
+            )
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+    def fuzzy_search(self, term):
+        if connection.vendor != 'postgresql':
+            return ingredient_index.fuzzy_search(
+                term,
+                settings.INGREDIENT_SEARCH_LIMIT,
+                settings.INGREDIENT_FUZZY_THRESHOLD
+            )
+
+        # Оператор % берёт порог из pg_trgm.similarity_threshold; задаём
+        # его из настроек на время транзакции, чтобы остался индекс.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                [str(settings.INGREDIENT_FUZZY_THRESHOLD)]
+            )
+            return list(
+                self.get_queryset()
+                .filter(name__trigram_similar=term)
+                .annotate(similarity=TrigramSimilarity('name', term))
+                .order_by('-similarity', 'name')
+                [:settings.INGREDIENT_SEARCH_LIMIT]
             )
-        return queryset
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     http_method_names = ('get', 'post', 'patch', 'delete')
     queryset = models.Recipe.objects.all()
     permission_classes = [IsAuthorOrReadOnly]
+    pagination_class = CursorOrPageNumberPagination
     filter_class = RecipeFilter
 
     def get_serializer_class(self):
@@ -82,13 +147,71 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeReadSerializer
         return serializers.RecipeSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'feed', 'pantry'):
+            context['image_rendition'] = 'card'
+        return context
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+
+        patch_vary_headers(response, ('Authorization',))
+        return set_validators(
+            response, etag=etag, last_modified=last_modified
+        )
 
+    def get_validators(self):
         user = self.request.user
+        try:
+            state = (
+                models.Recipe.objects
+                .filter(pk=self.kwargs[self.lookup_field])
+                .with_user_flags(user)
+                .annotate(**{
+                    f'author_{field}': F(f'author__{field}')
+                    for field in serializers.IsSubUserSerializer.Meta.fields
+                    if field not in ('id', 'is_subscribed')
+                })
+                .values()
+                .first()
+            )
+        except (TypeError, ValueError):
+            state = None
+
+        if state is None:
+            return None, None
+
+        rendition_modified = renditions.get_rendition_modified(
+            state['image'], serializers.RecipeReadSerializer.image_rendition
+        )
+        etag = make_etag(
+            *sorted(state.items()),
+            rendition_modified,
+            versions.get_version(versions.TAGS),
+            versions.get_version(versions.INGREDIENTS),
+        )
+        if user.is_authenticated:
+            return etag, None
+        last_modified = max(filter(None, (
+            state['modified'], rendition_modified
+        )))
+        return etag, int(last_modified.timestamp())
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = super().get_queryset().with_user_flags(user)
+
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.for_read()
 
         if not user.is_authenticated:
             return queryset
@@ -105,82 +228,147 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 "is_in_shopping_cart должен быть '0' или '1'."
             )
 
-        queryset = queryset.annotate(
-            num_favorites=Count(
-                'favorited_by',
-                filter=Q(favorited_by__user=user)
-            ),
-            num_cart=Count(
-                'added_to_cart_by',
-                filter=Q(added_to_cart_by__user=user)
-            )
-        )
-
-        if is_favorited == '1':
-            queryset = queryset.filter(num_favorites__gt=0)
-        elif is_favorited == '0':
-            queryset = queryset.filter(num_favorites=0)
+        if is_favorited is not None:
+            queryset = queryset.filter(is_favorited=is_favorited == '1')
 
-        if is_in_shopping_cart == '1':
-            queryset = queryset.filter(num_cart__gt=0)
-        elif is_in_shopping_cart == '0':
-            queryset = queryset.filter(num_cart=0)
+        if is_in_shopping_cart is not None:
+            queryset = queryset.filter(
+                is_in_shopping_cart=is_in_shopping_cart == '1'
+            )
 
         return queryset
 
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=FeedPagination
     )
-    def download_shopping_cart(self, request):
+    def feed(self, request):
         user = request.user
-        cart_recipes = (
-            models.ShoppingCartRecipe.objects
-            .filter(user=user)
-            .select_related('recipe')
-            .prefetch_related('recipe__ingredients')
+        page = self.paginate_queryset(
+            models.FeedEntry.objects.filter(user=user)
+        )
+        recipes = (
+            models.Recipe.objects
+            .for_read()
+            .with_user_flags(user)
+            .in_bulk([entry.recipe_id for entry in page])
+        )
+        serializer = serializers.RecipeReadSerializer(
+            [
+                recipes[entry.recipe_id] for entry in page
+                if entry.recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context()
         )
+        return self.get_paginated_response(serializer.data)
 
-        if cart_recipes:
-            shopping_list = defaultdict(dict)
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def pantry(self, request):
+        ingredient_ids = self.get_id_list('ingredients')
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': 'Укажите ингредиенты.'})
+        excluded_ids = self.get_id_list('exclude')
+        limit = self.get_pantry_limit()
 
-            recipe_ingredients = (
-                models.RecipeIngredient.objects
-                .filter(recipe__in=[cart.recipe for cart in cart_recipes])
-                .values_list('ingredient__name',
-                             'ingredient__measurement_unit')
-                .annotate(amount_sum=Sum('amount'))
-            )
+        queryset = models.Recipe.objects.for_read().with_user_flags(
+            request.user
+        )
+        ranked = pantry_index.search(ingredient_ids, excluded_ids)
+        recipes = []
+        while len(recipes) < limit:
+            chunk = list(islice(ranked, limit - len(recipes)))
+            if not chunk:
+                break
+            found = queryset.in_bulk([recipe_id for recipe_id, _, _ in chunk])
+            for recipe_id, matched, total in chunk:
+                recipe = found.get(recipe_id)
+                if recipe is not None:
+                    recipe.coverage = matched / total
+                    recipes.append(recipe)
+
+        serializer = serializers.PantryRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
-            for (ingredient_name, measurement_unit,
-                 amount_sum) in recipe_ingredients:
-                shopping_list[ingredient_name] = {
-                    'amount_sum': amount_sum,
-                    'measurement_unit': measurement_unit
-                }
-
-            response = HttpResponse(content_type='text/plain')
-            response[
-                'Content-Disposition'
-            ] = 'attachment; filename="shopping_list.txt"'
-
-            response.write('Список покупок:\n\n')
-            for ingredient_name, info in shopping_list.items():
-                amount = info['amount_sum']
-                measurement_unit = info['measurement_unit']
-                response.write(
-                    f'{ingredient_name} — {amount}'
-                    f' {measurement_unit}\n'
-                )
+    def get_id_list(self, param):
+        values = self.request.query_params.getlist(param)
+        try:
+            return [int(value) for value in values]
+        except ValueError:
+            raise ValidationError({param: 'Ожидаются целые id.'})
+
+    def get_pantry_limit(self):
+        try:
+            return parse_positive_int(
+                self.request.query_params['limit'],
+                cutoff=KeysetPagination.max_page_size
+            )
+        except KeyError:
+            return settings.PANTRY_SEARCH_LIMIT
+        except ValueError:
+            raise ValidationError(
+                {'limit': 'Должно быть положительным целым числом.'}
+            )
 
-            return response
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[permissions.IsAuthenticated],
+        parser_classes=[JSONParser, NDJSONParser]
+    )
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError('Ожидается список рецептов.')
+        if len(items) > settings.RECIPE_IMPORT_MAX_ITEMS:
+            raise ValidationError(
+                'За один запрос можно загрузить не более '
+                f'{settings.RECIPE_IMPORT_MAX_ITEMS} рецептов.'
+            )
 
-        return HttpResponse(
-            'У вас нет рецептов в корзине',
-            content_type='text/plain',
-            status=status.HTTP_404_NOT_FOUND
+        report = imports.import_recipes(
+            items, request.user, self.get_serializer_context()
         )
+        if report['created']:
+            return Response(report, status=status.HTTP_201_CREATED)
+        return Response(report, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS
+    )
+    def download_shopping_cart(self, request):
+        user = request.user
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+
+        version = shopping_list.get_cache_version(user)
+        content = shopping_list.get_cached(user, renderer.format, version)
+        if content is not None:
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            rows = shopping_list.iter_shopping_list(user)
+            if rows is None:
+                raise NotFound('У вас нет рецептов в корзине')
+            response = StreamingHttpResponse(
+                shopping_list.stream_and_cache(
+                    user, renderer.format, rows, version
+                ),
+                content_type=content_type
+            )
+
+        response[
+            'Content-Disposition'
+        ] = f'attachment; filename="shopping_list.{renderer.format}"'
+        return response
 
 
 class FollowAuthorView(APIView):
@@ -200,6 +388,11 @@ class FollowAuthorView(APIView):
         )
 
         if created:
+            jobs.enqueue(
+                tasks.BACKFILL_FEED,
+                user_id=user.id,
+                author_id=following_user.id
+            )
             serializer = serializers.UserRecipeSerializer(
                 following_user,
                 context={'request': request}
@@ -216,10 +409,12 @@ class FollowAuthorView(APIView):
         following = get_object_or_404(User, id=id)
 
         try:
-            follow = models.FollowAuthor.objects.get(
-                user=user, following_id=following
-            )
-            follow.delete()
+            with transaction.atomic():
+                follow = models.FollowAuthor.objects.get(
+                    user=user, following_id=following
+                )
+                follow.delete()
+                feed.prune(user.id, following.id)
 
             return Response(status=status.HTTP_204_NO_CONTENT)
         except models.FollowAuthor.DoesNotExist:
@@ -25,6 +25,21 @@ class TagRecipeAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'tag')
     list_editable = ('tag',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        models.Recipe.objects.filter(
+            pk__in={obj.recipe_id, form.initial.get('recipe')}
+        ).update_tags_mask()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        models.Recipe.objects.filter(pk=obj.recipe_id).update_tags_mask()
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        models.Recipe.objects.filter(pk__in=recipe_ids).update_tags_mask()
+
 
 @admin.register(models.RecipeIngredient)
 class IngredientRecipeAdmin(admin.ModelAdmin):
@@ -49,6 +64,10 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     inlines = [TagRecipeInline, IngredientRecipeInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        models.Recipe.objects.filter(pk=form.instance.pk).update_tags_mask()
+
     def get_tags(self, obj):
         tags_qs = obj.tags.all()
         return ', '.join(tags_qs.values_list('name', flat=True))
@@ -83,3 +102,16 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
 class ShoppingCartRecipeAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     list_editable = ('recipe',)
+
+
+@admin.register(models.ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_filter = ('user',)
+
+
+@admin.register(models.Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'attempts', 'run_after', 'modified')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created', 'modified')
@@ -0,0 +1,191 @@
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from app import models, versions
+
+# Три параметра на строку: не больше 999 переменных даже в старом SQLite.
+UPSERT_BATCH_SIZE = 300
+
+
+def get_recipe_amounts(recipe_id):
+    return Counter(dict(
+        models.RecipeIngredient.objects
+        .filter(recipe_id=recipe_id)
+        .values_list('ingredient_id', 'amount')
+    ))
+
+
+def get_live_totals(user_ids=None):
+    carts = models.ShoppingCartRecipe.objects.filter(
+        recipe__recipe_ingredient__isnull=False
+    )
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    return (
+        carts
+        .values_list('user_id', 'recipe__recipe_ingredient__ingredient_id')
+        .annotate(amount=Sum('recipe__recipe_ingredient__amount'))
+        .order_by()
+    )
+
+
+def bump_cart_versions(user_ids):
+    names = [versions.cart(user_id) for user_id in user_ids]
+    if names:
+        transaction.on_commit(lambda: versions.bump_version(*names))
+
+
+@transaction.atomic
+def apply_deltas(user_ids, deltas):
+    bump_cart_versions(user_ids)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+
+    added = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta > 0
+    }
+    if added:
+        add_amounts(user_ids, added)
+
+    removed = {
+        ingredient_id: -delta
+        for ingredient_id, delta in deltas.items() if delta < 0
+    }
+    if removed:
+        subtract_amounts(user_ids, removed)
+
+
+def add_amounts(user_ids, amounts):
+    """Прибавляет к итогам одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Строки, которых ещё нет, не заблокировать SELECT FOR UPDATE, поэтому
+    одновременные добавления сходятся на уникальном индексе.
+    """
+    table = connection.ops.quote_name(models.ShoppingListItem._meta.db_table)
+    rows = [
+        (user_id, ingredient_id, amount)
+        for user_id in user_ids
+        for ingredient_id, amount in amounts.items()
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                f'SET amount = {table}.amount + EXCLUDED.amount',
+                list(chain.from_iterable(batch))
+            )
+
+
+def subtract_amounts(user_ids, amounts):
+    items = models.ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=amounts
+    )
+    items.update(amount=Greatest(
+        F('amount') - Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in amounts.items()
+            ),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    ))
+    items.filter(amount=0).delete()
+
+
+def get_cart_user_ids(recipe_id):
+    return list(
+        models.ShoppingCartRecipe.objects
+        .filter(recipe_id=recipe_id)
+        .values_list('user_id', flat=True)
+    )
+
+
+def add_recipe(user_id, recipe_id):
+    apply_deltas([user_id], get_recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    amounts = get_recipe_amounts(recipe_id)
+    apply_deltas([user_id], {key: -value for key, value in amounts.items()})
+
+
+def remove_lines(lines):
+    """Списывает удалённые строки ингредиентов, по рецепту за раз."""
+    amounts = defaultdict(Counter)
+    for recipe_id, ingredient_id, amount in lines:
+        amounts[recipe_id][ingredient_id] += amount
+    for recipe_id, recipe_amounts in amounts.items():
+        change_recipe(recipe_id, recipe_amounts, {})
+
+
+def remove_carts(carts):
+    """Списывает удалённые из корзин рецепты, по рецепту за раз."""
+    user_ids = defaultdict(list)
+    for user_id, recipe_id in carts:
+        user_ids[recipe_id].append(user_id)
+    for recipe_id, recipe_user_ids in user_ids.items():
+        amounts = get_recipe_amounts(recipe_id)
+        apply_deltas(
+            recipe_user_ids, {key: -value for key, value in amounts.items()}
+        )
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    if not any(deltas.values()):
+        return
+    apply_deltas(get_cart_user_ids(recipe_id), deltas)
+
+
+@transaction.atomic
+def rebuild_totals():
+    models.ShoppingListItem.objects.all().delete()
+    models.ShoppingListItem.objects.bulk_create(
+        (
+            models.ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for user_id, ingredient_id, amount in get_live_totals().iterator()
+        ),
+        batch_size=1000
+    )
+    transaction.on_commit(
+        lambda: versions.bump_version(versions.SHOPPING_LISTS)
+    )
+
+
+def find_mismatches():
+    live = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in get_live_totals().iterator()
+    }
+    stored = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in (
+            models.ShoppingListItem.objects
+            .values_list('user_id', 'ingredient_id', 'amount')
+            .iterator()
+        )
+    }
+    mismatches = []
+    for user_id, ingredient_id in sorted(live.keys() | stored.keys()):
+        key = (user_id, ingredient_id)
+        if stored.get(key) != live.get(key):
+            mismatches.append(
+                (user_id, ingredient_id, stored.get(key), live.get(key))
+            )
+    return mismatches
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+from app.models import FeedEntry, FollowAuthor, Recipe
+
+
+def push_recipes(recipe_ids):
+    recipes = list(
+        Recipe.objects
+        .filter(pk__in=recipe_ids)
+        .values_list('id', 'author_id', 'created')
+    )
+    followers = defaultdict(list)
+    for user_id, author_id in (
+        FollowAuthor.objects
+        .filter(following_id__in={author for _, author, _ in recipes})
+        .values_list('user_id', 'following_id')
+        .iterator()
+    ):
+        followers[author_id].append(user_id)
+
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                created=created
+            )
+            for recipe_id, author_id, created in recipes
+            for user_id in followers[author_id]
+        ),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    if not FollowAuthor.objects.filter(
+        user_id=user_id, following_id=author_id
+    ).exists():
+        return
+
+    recipes = (
+        Recipe.objects
+        .filter(author_id=author_id)
+        .order_by('-created', '-id')
+        .values_list('id', 'created')
+    )[:settings.FEED_BACKFILL_LIMIT]
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                created=created
+            )
+            for recipe_id, created in recipes
+        ),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def prune(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild():
+    FeedEntry.objects.all().delete()
+    follows = FollowAuthor.objects.values_list('user_id', 'following_id')
+    for user_id, author_id in follows.iterator():
+        backfill(user_id, author_id)
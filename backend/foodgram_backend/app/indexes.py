@@ -0,0 +1,273 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from app import versions
+from app.models import DeletedRecipe, Ingredient, Recipe, RecipeIngredient
+
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def get_trigrams(text):
+    trigrams = set()
+    for word in WORD_PATTERN.findall(text.casefold()):
+        padded = f'  {word} '
+        trigrams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2)
+        )
+    return trigrams
+
+
+class VersionedIndex:
+    """Индекс в памяти процесса, перестраиваемый при смене версии данных."""
+    version_names = ()
+
+    def __init__(self):
+        self.version = None
+        self.lock = threading.Lock()
+
+    def ensure_fresh(self):
+        version = versions.get_versions(*self.version_names)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.refresh(version)
+                    self.version = version
+
+    def refresh(self, version):
+        self.build()
+
+    def build(self):
+        raise NotImplementedError
+
+
+class IngredientIndex(VersionedIndex):
+    version_names = (versions.INGREDIENTS,)
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (ingredient.name.casefold(), ingredient.id)
+        )
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+
+        trigram_counts = []
+        postings = defaultdict(list)
+        for position, ingredient in enumerate(ingredients):
+            trigrams = get_trigrams(ingredient.name)
+            trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                postings[trigram].append(position)
+
+        self.snapshot = (keys, ingredients, trigram_counts, postings)
+
+    def search(self, term, limit):
+        self.ensure_fresh()
+        keys, ingredients, _, _ = self.snapshot
+        term = term.casefold()
+
+        start = bisect_left(keys, term)
+        end = start
+        while end < len(keys) and keys[end].startswith(term):
+            end += 1
+        results = ingredients[start:min(end, start + limit)]
+
+        for key, ingredient in zip(keys, ingredients):
+            if len(results) >= limit:
+                break
+            if term in key and not key.startswith(term):
+                results.append(ingredient)
+        return results
+
+    def fuzzy_search(self, term, limit, threshold):
+        self.ensure_fresh()
+        _, ingredients, trigram_counts, postings = self.snapshot
+        trigrams = get_trigrams(term)
+
+        matches = Counter()
+        for trigram in trigrams:
+            matches.update(postings.get(trigram, ()))
+
+        scored = []
+        for position, common in matches.items():
+            similarity = common / (
+                len(trigrams) + trigram_counts[position] - common
+            )
+            if similarity >= threshold:
+                scored.append((similarity, -position))
+
+        return [
+            ingredients[-order]
+            for similarity, order in heapq.nlargest(limit, scored)
+        ]
+
+
+class PantryIndex(VersionedIndex):
+    """Обратный индекс ингредиент → рецепты в виде битовых множеств.
+
+    Номер бита — id рецепта. Кроме множеств ингредиентов хранятся множества
+    рецептов с одинаковым числом строк ингредиентов, чтобы считать покрытие.
+    После записи рецептов индекс дочитывает изменённые по ``modified``,
+    а удалённые — по их следам в ``DeletedRecipe``.
+    """
+    version_names = (versions.RECIPES, versions.INGREDIENTS)
+
+    def refresh(self, version):
+        if self.version is None or version[1] != self.version[1]:
+            self.build()
+        else:
+            self.sync()
+
+    def build(self):
+        synced_at = timezone.now()
+        lines = defaultdict(list)
+        for recipe_id, ingredient_id in (
+            RecipeIngredient.objects
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator()
+        ):
+            lines[recipe_id].append(ingredient_id)
+
+        size = max(lines, default=0) // 8 + 1
+        ingredient_bytes = defaultdict(lambda: bytearray(size))
+        count_bytes = defaultdict(lambda: bytearray(size))
+        for recipe_id, ingredient_ids in lines.items():
+            index, bit = divmod(recipe_id, 8)
+            count_bytes[len(ingredient_ids)][index] |= 1 << bit
+            for ingredient_id in ingredient_ids:
+                ingredient_bytes[ingredient_id][index] |= 1 << bit
+
+        self.snapshot = (
+            self.to_bitsets(ingredient_bytes),
+            self.to_bitsets(count_bytes),
+            {
+                recipe_id: tuple(ingredient_ids)
+                for recipe_id, ingredient_ids in lines.items()
+            },
+        )
+        self.synced_at = synced_at
+
+    @staticmethod
+    def to_bitsets(byte_sets):
+        return {
+            key: int.from_bytes(value, 'little')
+            for key, value in byte_sets.items()
+        }
+
+    def sync(self):
+        synced_at = timezone.now()
+        since = self.synced_at - timedelta(
+            seconds=settings.PANTRY_INDEX_SYNC_OVERLAP
+        )
+        # Следы удалений старше срока хранения уже могли быть удалены.
+        if since < synced_at - timedelta(
+            seconds=settings.PANTRY_INDEX_DELETED_RETENTION
+        ):
+            self.build()
+            return
+
+        changes = {
+            recipe_id: ()
+            for recipe_id in DeletedRecipe.objects.filter(
+                deleted__gte=since
+            ).values_list('recipe_id', flat=True)
+        }
+        changes.update(
+            (recipe_id, [])
+            for recipe_id in Recipe.objects.filter(
+                modified__gte=since
+            ).values_list('id', flat=True)
+        )
+        for recipe_id, ingredient_id in (
+            RecipeIngredient.objects
+            .filter(recipe_id__in=changes)
+            .values_list('recipe_id', 'ingredient_id')
+        ):
+            changes[recipe_id].append(ingredient_id)
+
+        ingredients, counts, lines = (dict(part) for part in self.snapshot)
+        self.apply(ingredients, counts, lines, changes)
+
+        self.snapshot = (ingredients, counts, lines)
+        self.synced_at = synced_at
+
+    @classmethod
+    def apply(cls, ingredients, counts, lines, changes):
+        for recipe_id, ingredient_ids in changes.items():
+            bit = 1 << recipe_id
+            old_ingredient_ids = lines.pop(recipe_id, ())
+            if old_ingredient_ids:
+                cls.discard(counts, len(old_ingredient_ids), bit)
+            for ingredient_id in old_ingredient_ids:
+                cls.discard(ingredients, ingredient_id, bit)
+
+            if not ingredient_ids:
+                continue
+            lines[recipe_id] = tuple(ingredient_ids)
+            counts[len(ingredient_ids)] = (
+                counts.get(len(ingredient_ids), 0) | bit
+            )
+            for ingredient_id in ingredient_ids:
+                ingredients[ingredient_id] = (
+                    ingredients.get(ingredient_id, 0) | bit
+                )
+
+    @staticmethod
+    def discard(bitsets, key, bit):
+        bitset = bitsets[key] & ~bit
+        if bitset:
+            bitsets[key] = bitset
+        else:
+            del bitsets[key]
+
+    def search(self, ingredient_ids, excluded_ids=()):
+        """Рецепты по убыванию покрытия: (id, совпало строк, всего строк)."""
+        self.ensure_fresh()
+        ingredients, counts, _ = self.snapshot
+
+        # Число совпавших строк у каждого рецепта, по битам: planes[i]
+        # содержит рецепты, у которых в этом числе выставлен i-й бит.
+        planes = []
+        for ingredient_id in set(ingredient_ids):
+            carry = ingredients.get(ingredient_id, 0)
+            for index, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[index], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+
+        excluded = 0
+        for ingredient_id in set(excluded_ids):
+            excluded |= ingredients.get(ingredient_id, 0)
+
+        levels = sorted(
+            (
+                (matched, total)
+                for total in counts
+                for matched in range(1, min(total, 2 ** len(planes) - 1) + 1)
+            ),
+            key=lambda level: (level[0] / level[1], level[0]),
+            reverse=True
+        )
+        for matched, total in levels:
+            recipes = counts[total] & ~excluded
+            for index, plane in enumerate(planes):
+                if not recipes:
+                    break
+                recipes &= plane if matched >> index & 1 else ~plane
+            while recipes:
+                recipe_id = recipes.bit_length() - 1
+                recipes ^= 1 << recipe_id
+                yield recipe_id, matched, total
+
+
+ingredient_index = IngredientIndex()
+pantry_index = PantryIndex()
@@ -0,0 +1,100 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app.models import Job
+
+handlers = {}
+
+
+def handler(kind):
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, **payload):
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def enqueue_many(kind, payloads):
+    return Job.objects.bulk_create(
+        Job(kind=kind, payload=payload) for payload in payloads
+    )
+
+
+def claim_job():
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_TIMEOUT)
+    while True:
+        with transaction.atomic():
+            job = (
+                Job.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=Job.PENDING, run_after__lte=now)
+                    | Q(status=Job.RUNNING, modified__lt=stale)
+                )
+                .first()
+            )
+            if job is None:
+                return None
+
+            # Зависшая задача, исчерпавшая попытки, больше не запускается.
+            if (
+                job.status == Job.RUNNING
+                and job.attempts >= settings.JOB_MAX_ATTEMPTS
+            ):
+                job.status = Job.FAILED
+                job.last_error = (
+                    f'Задача не завершилась за {settings.JOB_TIMEOUT} с.'
+                )
+                job.save(update_fields=('status', 'last_error', 'modified'))
+                continue
+
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.save(update_fields=('status', 'attempts', 'modified'))
+        return job
+
+
+def run_job(job):
+    try:
+        handlers[job.kind](**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(
+                seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+    else:
+        job.status = Job.DONE
+    job.save()
+    return job
+
+
+def prune_done():
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_DONE_RETENTION)
+    deleted, _ = Job.objects.filter(
+        status=Job.DONE, modified__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def run_pending(limit=None):
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app import renditions
+from app.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие уменьшенные копии изображений рецептов.'
+
+    def handle(self, *args, **kwargs):
+        images = (
+            Recipe.objects
+            .exclude(image='')
+            .values_list('image', flat=True)
+            .distinct()
+        )
+        for image_name in images.iterator():
+            renditions.create_renditions(image_name)
+        self.stdout.write('Изображения подготовлены!')
@@ -3,6 +3,7 @@ from pathlib import Path
 
 from django.core.management.base import BaseCommand
 
+from app import versions
 from app.models import Ingredient
 
 
@@ -22,4 +23,5 @@ class Command(BaseCommand):
                 objects_to_create.append(model(**args))
             model.objects.bulk_create(objects_to_create,
                                       ignore_conflicts=True)
+        versions.bump_version(versions.INGREDIENTS)
         self.stdout.write("Все данные загружены!")
@@ -0,0 +1,82 @@
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from api.imports import import_recipes
+
+User = get_user_model()
+
+
+def iter_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Строка {number}: {error}')
+
+
+class Command(BaseCommand):
+    help = 'Загружает рецепты из файла JSON (массив) или NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или «-» для stdin.')
+        parser.add_argument(
+            '--author',
+            required=True,
+            help='Имя пользователя или email автора рецептов.'
+        )
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(
+                Q(username=options['author']) | Q(email=options['author'])
+            )
+        except User.DoesNotExist:
+            raise CommandError('Автор не найден.')
+
+        if options['path'] == '-':
+            self.load(sys.stdin, author, options['batch_size'])
+        else:
+            with open(options['path'], encoding='utf8') as file:
+                self.load(file, author, options['batch_size'])
+
+    def load(self, file, author, batch_size):
+        head = file.read(1)
+        while head.isspace():
+            head = file.read(1)
+        if head == '[':
+            try:
+                items = json.loads(head + file.read())
+            except ValueError as error:
+                raise CommandError(f'Некорректный JSON: {error}')
+        else:
+            items = iter_ndjson(self.prepend(head, file))
+
+        started = time.monotonic()
+        report = import_recipes(items, author, batch_size=batch_size)
+        elapsed = time.monotonic() - started
+
+        for error in report['errors']:
+            self.stderr.write(
+                f'#{error["index"]}: '
+                f'{json.dumps(error["errors"], ensure_ascii=False)}'
+            )
+        created = len(report['created'])
+        self.stdout.write(
+            f'Загружено рецептов: {created}, ошибок: {len(report["errors"])}, '
+            f'{elapsed:.1f} с ({created / max(elapsed, 1e-9):.0f} рецептов/с)'
+        )
+
+    @staticmethod
+    def prepend(head, file):
+        first = head + file.readline()
+        yield first
+        yield from file
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app import feed
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет ленты подписок по текущим подпискам.'
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            feed.rebuild()
+        self.stdout.write('Ленты подписок заполнены!')
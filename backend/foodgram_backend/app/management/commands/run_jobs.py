@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, ожидая новые задачи.'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Пауза в секундах, когда очередь пуста.'
+        )
+
+    def handle(self, *args, **options):
+        processed = True
+        while True:
+            # Новые выполненные задачи появляются только после прохода,
+            # в котором что-то выполнялось.
+            if processed:
+                pruned = jobs.prune_done()
+                if pruned:
+                    self.stdout.write(f'Удалено выполненных задач: {pruned}')
+            processed = jobs.run_pending()
+            if processed:
+                self.stdout.write(f'Выполнено задач: {processed}')
+            if not options['loop']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
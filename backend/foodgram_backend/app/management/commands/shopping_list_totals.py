@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import cart
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает или проверяет итоги списков покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить итоги с корзинами, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            cart.rebuild_totals()
+            self.stdout.write('Списки покупок пересчитаны!')
+            return
+
+        mismatches = cart.find_mismatches()
+        for user_id, ingredient_id, stored, live in mismatches:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored}, в корзине {live}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write('Расхождений нет!')
@@ -0,0 +1,66 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    ShoppingCartRecipe = apps.get_model('app', 'ShoppingCartRecipe')
+    ShoppingListItem = apps.get_model('app', 'ShoppingListItem')
+    totals = (
+        ShoppingCartRecipe.objects
+        .filter(recipe__recipe_ingredient__isnull=False)
+        .values_list('user_id', 'recipe__recipe_ingredient__ingredient_id')
+        .annotate(amount=Sum('recipe__recipe_ingredient__amount'))
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for user_id, ingredient_id, amount in totals
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0015_recipe_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('amount',
+                 models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient',
+                 models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                   related_name='shopping_list_items',
+                                   to='app.ingredient',
+                                   verbose_name='Ингредиент')),
+                ('user',
+                 models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                   related_name='shopping_list',
+                                   to=settings.AUTH_USER_MODEL,
+                                   verbose_name='Владелец списка')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Списки покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_user_ingredient'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app', '0016_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('kind', models.CharField(max_length=200,
+                                          verbose_name='Тип')),
+                ('payload', models.JSONField(default=dict,
+                                             verbose_name='Параметры')),
+                ('status', models.CharField(
+                    choices=[('pending', 'В очереди'),
+                             ('running', 'Выполняется'),
+                             ('done', 'Выполнена'),
+                             ('failed', 'Ошибка')],
+                    default='pending', max_length=16,
+                    verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(
+                    default=0, verbose_name='Попытки')),
+                ('last_error', models.TextField(
+                    blank=True, verbose_name='Последняя ошибка')),
+                ('run_after', models.DateTimeField(
+                    default=django.utils.timezone.now,
+                    verbose_name='Запустить после')),
+                ('created', models.DateTimeField(
+                    auto_now_add=True, verbose_name='Дата создания')),
+                ('modified', models.DateTimeField(
+                    auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'ordering': ('run_after', 'id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'],
+                               name='job_status_run_after'),
+        ),
+    ]
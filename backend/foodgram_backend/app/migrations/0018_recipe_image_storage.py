@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+import app.storage
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app', '0017_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(
+                storage=app.storage.ContentAddressedStorage(),
+                upload_to='recipes/images',
+                verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+POSTGRESQL_FORWARD = (
+    "ALTER TABLE app_recipe ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+    ") STORED",
+    'CREATE INDEX app_recipe_search_vector '
+    'ON app_recipe USING gin (search_vector)',
+)
+POSTGRESQL_BACKWARD = (
+    'ALTER TABLE app_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS app_recipe_fts_insert '
+    'AFTER INSERT ON app_recipe BEGIN '
+    'INSERT INTO app_recipe_fts(rowid, name, text) '
+    'VALUES (new.id, new.name, new.text); END',
+    'CREATE TRIGGER IF NOT EXISTS app_recipe_fts_delete '
+    'AFTER DELETE ON app_recipe BEGIN '
+    'INSERT INTO app_recipe_fts(app_recipe_fts, rowid, name, text) '
+    "VALUES ('delete', old.id, old.name, old.text); END",
+    'CREATE TRIGGER IF NOT EXISTS app_recipe_fts_update '
+    'AFTER UPDATE ON app_recipe BEGIN '
+    'INSERT INTO app_recipe_fts(app_recipe_fts, rowid, name, text) '
+    "VALUES ('delete', old.id, old.name, old.text); "
+    'INSERT INTO app_recipe_fts(rowid, name, text) '
+    'VALUES (new.id, new.name, new.text); END',
+)
+SQLITE_FORWARD = (
+    'CREATE VIRTUAL TABLE app_recipe_fts USING fts5('
+    "name, text, content='app_recipe', content_rowid='id')",
+    *SQLITE_TRIGGERS,
+    "INSERT INTO app_recipe_fts(app_recipe_fts) VALUES ('rebuild')",
+)
+SQLITE_BACKWARD = (
+    'DROP TRIGGER IF EXISTS app_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS app_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS app_recipe_fts_update',
+    'DROP TABLE IF EXISTS app_recipe_fts',
+)
+
+
+def execute_for_vendor(postgresql, sqlite):
+    def operation(apps, schema_editor):
+        statements = {
+            'postgresql': postgresql,
+            'sqlite': sqlite,
+        }.get(schema_editor.connection.vendor, ())
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app', '0019_feedentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            execute_for_vendor(POSTGRESQL_FORWARD, SQLITE_FORWARD),
+            execute_for_vendor(POSTGRESQL_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,75 @@
+import importlib
+from collections import defaultdict
+
+from django.db import migrations, models
+
+recipe_search = importlib.import_module('app.migrations.0020_recipe_search')
+
+UPDATE_BATCH_SIZE = 500
+
+
+def create_fts_triggers(apps, schema_editor):
+    # На SQLite добавление столбца пересоздаёт app_recipe вместе с
+    # триггерами полнотекстового поиска из 0020.
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in recipe_search.SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+def fill_tags_mask(apps, schema_editor):
+    Tag = apps.get_model('app', 'Tag')
+    Recipe = apps.get_model('app', 'Recipe')
+    RecipeTag = apps.get_model('app', 'RecipeTag')
+
+    bits = {}
+    for bit, tag in enumerate(Tag.objects.order_by('id')):
+        tag.bit = bit
+        tag.save(update_fields=['bit'])
+        bits[tag.id] = bit
+
+    masks = defaultdict(int)
+    for recipe_id, tag_id in RecipeTag.objects.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator():
+        masks[recipe_id] |= 1 << bits[tag_id]
+
+    recipes_by_mask = defaultdict(list)
+    for recipe_id, mask in masks.items():
+        recipes_by_mask[mask].append(recipe_id)
+    for mask, recipe_ids in recipes_by_mask.items():
+        for start in range(0, len(recipe_ids), UPDATE_BATCH_SIZE):
+            Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + UPDATE_BATCH_SIZE]
+            ).update(tags_mask=mask)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('app', '0021_recipe_modified_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_fts_triggers),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(
+                editable=False, null=True,
+                verbose_name='Бит в маске тегов'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False,
+                                         verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(
+                editable=False, unique=True,
+                verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(create_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,27 @@
+import re
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.core.exceptions import ValidationError
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (BigIntegerField, Exists, ExpressionWrapper, F,
+                              OuterRef, Prefetch, Q, Subquery, Sum, Value,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, RowNumber
+from django.utils import timezone
 
 from constants import NAME_SLUG_MEAS_UNIT_LENGTH
+from .storage import ContentAddressedStorage
 from .validators import validate_positive
 
 User = get_user_model()
 
+RECIPE_SEARCH_CONFIG = 'russian'
+TAG_MASK_BITS = 63
+
 
 class Name(models.Model):
     name = models.CharField('Название', max_length=NAME_SLUG_MEAS_UNIT_LENGTH)
@@ -42,19 +57,161 @@ class Tag(Name):
     slug = models.SlugField(
         'Ссылка', max_length=NAME_SLUG_MEAS_UNIT_LENGTH, unique=True
     )
+    bit = models.PositiveSmallIntegerField(
+        'Бит в маске тегов', unique=True, editable=False
+    )
 
     class Meta(Name.Meta):
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
         default_related_name = 'tags'
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    def get_free_bit(self):
+        used = set(Tag.objects.values_list('bit', flat=True))
+        for bit in range(TAG_MASK_BITS):
+            if bit not in used:
+                return bit
+        raise ValidationError(
+            f'Тегов не может быть больше {TAG_MASK_BITS}.'
+        )
+
+    def clean(self):
+        if self.bit is None:
+            self.get_free_bit()
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.get_free_bit()
+        super().save(*args, **kwargs)
+
+
+class RecipeQuerySet(models.QuerySet):
+    def for_read(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self
+
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCartRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            author_is_subscribed=Exists(FollowAuthor.objects.filter(
+                user=user, following=OuterRef('author')
+            )),
+        )
+
+    def with_tags(self, mask, match_all=False):
+        """Рецепты с любым (или всеми) из тегов маски, без JOIN."""
+        queryset = self.alias(matched_tags=F('tags_mask').bitand(mask))
+        if match_all:
+            return queryset.filter(matched_tags=mask)
+        return queryset.filter(matched_tags__gt=0)
+
+    def update_tags_mask(self):
+        masks = (
+            RecipeTag.objects
+            .filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(mask=Sum(ExpressionWrapper(
+                Cast(Value(1), BigIntegerField()).bitleftshift(
+                    F('tag__bit')
+                ),
+                output_field=BigIntegerField()
+            )))
+            .values('mask')
+        )
+        return self.update(tags_mask=Coalesce(
+            Subquery(masks, output_field=BigIntegerField()), 0
+        ))
+
+    def first_per_author(self, author_ids, limit):
+        """Первые ``limit`` рецептов каждого автора одним запросом."""
+        ranked = (
+            self.filter(author_id__in=author_ids)
+            .annotate(author_position=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('created').asc(), F('id').asc()),
+            ))
+            .order_by()
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) AS ranked '
+            'WHERE author_position <= %s '
+            'ORDER BY author_id, author_position',
+            (*params, limit)
+        )
+
+    def search(self, term):
+        """Полнотекстовый поиск по названию и тексту с ранжированием.
+
+        На PostgreSQL используется столбец ``search_vector`` с GIN-индексом,
+        на SQLite — таблица FTS5 ``app_recipe_fts`` (миграция 0020).
+        """
+        vendor = connections[self.db].vendor
+        table = self.model._meta.db_table
+
+        if vendor == 'postgresql':
+            query = SearchQuery(
+                term, config=RECIPE_SEARCH_CONFIG, search_type='websearch'
+            )
+            queryset = (
+                self.alias(search_vector=RawSQL(
+                    f'"{table}"."search_vector"', [],
+                    output_field=SearchVectorField()
+                ))
+                .filter(search_vector=query)
+                .annotate(search_rank=SearchRank(F('search_vector'), query))
+            )
+        elif vendor == 'sqlite':
+            words = re.findall(r'\w+', term)
+            if not words:
+                return self.none()
+            match = ' '.join(f'"{word}"*' for word in words)
+            queryset = self.extra(
+                tables=[f'{table}_fts'],
+                where=[
+                    f'{table}_fts MATCH %s',
+                    f'{table}_fts.rowid = "{table}"."id"',
+                ],
+                params=[match],
+                select={'search_rank': f'-bm25({table}_fts, 2.5, 1.0)'},
+            )
+        else:
+            return self.filter(
+                Q(name__icontains=term) | Q(text__icontains=term)
+            )
+
+        return queryset.order_by('-search_rank', '-created', '-id')
+
 
 class Recipe(Name):
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         verbose_name='Автор'
     )
-    image = models.ImageField('Изображение', upload_to='recipes/images')
+    image = models.ImageField(
+        'Изображение',
+        upload_to='recipes/images',
+        storage=ContentAddressedStorage()
+    )
     text = models.TextField('Текст')
     ingredients = models.ManyToManyField(
         Ingredient, through='RecipeIngredient',
@@ -72,12 +229,21 @@ class Recipe(Name):
         auto_now_add=True,
         db_index=True,
     )
+    modified = models.DateTimeField('Дата изменения', auto_now=True)
+    tags_mask = models.BigIntegerField(
+        'Маска тегов', default=0, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta(Name.Meta):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['modified'], name='recipe_modified'),
+        ]
 
 
 class RecipeTag(models.Model):
@@ -98,6 +264,28 @@ class RecipeTag(models.Model):
         default_related_name = 'recipe_tag'
 
 
+class RecipeIngredientQuerySet(models.QuerySet):
+    def delete(self):
+        # Каскад из рецепта или ингредиента идёт мимо этого метода: рецепт
+        # целиком списывает из корзин сигнал pre_delete, а итоги по
+        # удалённому ингредиенту удаляются вместе с ним.
+        from app import cart, versions
+
+        with transaction.atomic(using=self.db):
+            lines = list(
+                self.values_list('recipe_id', 'ingredient_id', 'amount')
+            )
+            deleted = super().delete()
+            cart.remove_lines(lines)
+            Recipe.objects.filter(
+                pk__in={recipe_id for recipe_id, _, _ in lines}
+            ).update(modified=timezone.now())
+        transaction.on_commit(
+            lambda: versions.bump_version(versions.RECIPES), using=self.db
+        )
+        return deleted
+
+
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
@@ -110,6 +298,8 @@ class RecipeIngredient(models.Model):
         validators=[validate_positive]
     )
 
+    objects = RecipeIngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
@@ -121,6 +311,9 @@ class RecipeIngredient(models.Model):
         ]
         default_related_name = 'recipe_ingredient'
 
+    def delete(self, using=None, keep_parents=False):
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
+
 
 class FollowAuthor(models.Model):
     user = models.ForeignKey(
@@ -172,6 +365,19 @@ class FavoriteRecipe(models.Model):
         verbose_name_plural = 'Любимые рецепты'
 
 
+class ShoppingCartRecipeQuerySet(models.QuerySet):
+    def delete(self):
+        # При каскаде из пользователя его итоги удаляются вместе с ним,
+        # при каскаде из рецепта их списывает сигнал pre_delete рецепта.
+        from app import cart
+
+        with transaction.atomic(using=self.db):
+            carts = list(self.values_list('user_id', 'recipe_id'))
+            deleted = super().delete()
+            cart.remove_carts(carts)
+        return deleted
+
+
 class ShoppingCartRecipe(models.Model):
     user = models.ForeignKey(
         User,
@@ -186,6 +392,8 @@ class ShoppingCartRecipe(models.Model):
         verbose_name='Рецепт в корзине'
     )
 
+    objects = ShoppingCartRecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -195,3 +403,122 @@ class ShoppingCartRecipe(models.Model):
         ]
         verbose_name = 'Рецепт в корзине'
         verbose_name_plural = 'Рецепты в корзинах'
+
+    def delete(self, using=None, keep_parents=False):
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Владелец списка'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_user_ingredient'
+            )
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, заполняется фоновыми задачами."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    created = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-created', '-id')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_user_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-id'],
+                name='feed_user_created'
+            ),
+            models.Index(fields=['user', 'author'], name='feed_user_author'),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+
+
+class DeletedRecipe(models.Model):
+    """След удалённого рецепта для индексов в памяти процессов."""
+    recipe_id = models.BigIntegerField('Рецепт')
+    deleted = models.DateTimeField(
+        'Дата удаления', default=timezone.now, db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Удалённый рецепт'
+        verbose_name_plural = 'Удалённые рецепты'
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    kind = models.CharField('Тип', max_length=NAME_SLUG_MEAS_UNIT_LENGTH)
+    payload = models.JSONField('Параметры', default=dict)
+    status = models.CharField(
+        'Статус', max_length=16, choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    run_after = models.DateTimeField('Запустить после', default=timezone.now)
+    created = models.DateTimeField('Дата создания', auto_now_add=True)
+    modified = models.DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        ordering = ('run_after', 'id')
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'], name='job_status_run_after'
+            )
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
@@ -0,0 +1,65 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+RENDITIONS_DIR = 'renditions'
+RENDITIONS = {
+    'card': {'size': (480, 480), 'crop': True},
+    'detail': {'size': (1200, 1200), 'crop': False},
+}
+RENDITION_QUALITY = 80
+
+
+def get_rendition_name(image_name, rendition):
+    return '/'.join(
+        (RENDITIONS_DIR, rendition, os.path.basename(image_name) + '.webp')
+    )
+
+
+def get_rendition_modified(image_name, rendition, storage=default_storage):
+    name = get_rendition_name(image_name, rendition)
+    if not storage.exists(name):
+        return None
+    return storage.get_modified_time(name)
+
+
+def get_rendition_url(image, rendition, storage=default_storage):
+    name = get_rendition_name(image.name, rendition)
+    if storage.exists(name):
+        return storage.url(name)
+    return image.url
+
+
+def render(image, size, crop):
+    if crop:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+
+def create_renditions(image_name, storage=default_storage):
+    names = {
+        rendition: get_rendition_name(image_name, rendition)
+        for rendition in RENDITIONS
+    }
+    missing = [
+        rendition for rendition, name in names.items()
+        if not storage.exists(name)
+    ]
+    if not missing:
+        return
+
+    with storage.open(image_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    for rendition in missing:
+        buffer = BytesIO()
+        render(image, **RENDITIONS[rendition]).save(
+            buffer, 'WEBP', quality=RENDITION_QUALITY
+        )
+        storage.save(names[rendition], ContentFile(buffer.getvalue()))
@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from app import cart, versions
+from app.models import (DeletedRecipe, Ingredient, Recipe,
+                        RecipeIngredient, ShoppingCartRecipe, Tag)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    transaction.on_commit(
+        lambda: versions.bump_version(versions.INGREDIENTS)
+    )
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def bump_tags_version(**kwargs):
+    transaction.on_commit(lambda: versions.bump_version(versions.TAGS))
+
+
+@receiver(pre_delete, sender=Tag)
+def clear_tag_bit(instance, **kwargs):
+    Recipe.objects.with_tags(instance.mask).update(
+        tags_mask=F('tags_mask') - instance.mask
+    )
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def bump_recipes_version(**kwargs):
+    transaction.on_commit(lambda: versions.bump_version(versions.RECIPES))
+
+
+@receiver(post_delete, sender=Recipe)
+def remember_deleted_recipe(instance, **kwargs):
+    DeletedRecipe.objects.create(recipe_id=instance.pk)
+    DeletedRecipe.objects.filter(deleted__lt=timezone.now() - timedelta(
+        seconds=settings.PANTRY_INDEX_DELETED_RETENTION
+    )).delete()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def touch_recipe(instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        modified=timezone.now()
+    )
+    transaction.on_commit(lambda: versions.bump_version(versions.RECIPES))
+
+
+def remember_saved_state(instance, *fields):
+    instance.saved_state = None
+    if instance.pk is not None:
+        instance.saved_state = (
+            type(instance).objects
+            .filter(pk=instance.pk)
+            .values_list(*fields)
+            .first()
+        )
+
+
+# Итоги списков покупок ведутся здесь, чтобы их не обходила админка.
+# Удаление строк и корзин списывают QuerySet.delete этих моделей, а
+# каскад при удалении рецепта обходит их: рецепт списывается целиком.
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_carts(instance, **kwargs):
+    cart.change_recipe(
+        instance.pk, cart.get_recipe_amounts(instance.pk), {}
+    )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(instance, **kwargs):
+    remember_saved_state(instance, 'recipe_id', 'ingredient_id', 'amount')
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_carts_on_line_save(instance, **kwargs):
+    old_recipe_id, old_ingredient_id, old_amount = (
+        instance.saved_state or (instance.recipe_id, None, 0)
+    )
+    if old_recipe_id != instance.recipe_id:
+        cart.change_recipe(old_recipe_id, {old_ingredient_id: old_amount}, {})
+        old_amount = 0
+    cart.change_recipe(
+        instance.recipe_id,
+        {old_ingredient_id: old_amount},
+        {instance.ingredient_id: instance.amount}
+    )
+
+
+@receiver(pre_save, sender=ShoppingCartRecipe)
+def remember_cart_recipe(instance, **kwargs):
+    remember_saved_state(instance, 'user_id', 'recipe_id')
+
+
+@receiver(post_save, sender=ShoppingCartRecipe)
+def update_totals_on_cart_save(instance, **kwargs):
+    state = (instance.user_id, instance.recipe_id)
+    if instance.saved_state == state:
+        return
+    if instance.saved_state is not None:
+        cart.remove_recipe(*instance.saved_state)
+    cart.add_recipe(*state)
@@ -0,0 +1,20 @@
+from app import feed, jobs, renditions
+
+CREATE_RENDITIONS = 'create_renditions'
+PUSH_TO_FEED = 'push_to_feed'
+BACKFILL_FEED = 'backfill_feed'
+
+
+@jobs.handler(CREATE_RENDITIONS)
+def create_renditions(image_name):
+    renditions.create_renditions(image_name)
+
+
+@jobs.handler(PUSH_TO_FEED)
+def push_to_feed(recipe_ids):
+    feed.push_recipes(recipe_ids)
+
+
+@jobs.handler(BACKFILL_FEED)
+def backfill_feed(user_id, author_id):
+    feed.backfill(user_id, author_id)
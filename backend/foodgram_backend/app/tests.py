@@ -0,0 +1,537 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app import cart, jobs, models, versions
+from app.indexes import PantryIndex
+
+User = get_user_model()
+
+
+class VersionBumpTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assert_bumped_on_commit(self, name, write):
+        version = versions.get_version(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+            self.assertEqual(versions.get_version(name), version)
+        self.assertNotEqual(versions.get_version(name), version)
+
+    def test_ingredient_version_bumped_on_commit(self):
+        self.assert_bumped_on_commit(
+            versions.INGREDIENTS,
+            lambda: models.Ingredient.objects.create(
+                name='Соль', measurement_unit='г'
+            )
+        )
+
+    def test_tag_version_bumped_on_commit(self):
+        self.assert_bumped_on_commit(
+            versions.TAGS,
+            lambda: models.Tag.objects.create(
+                name='Ужин', color='#8775D2', slug='dinner'
+            )
+        )
+
+
+class CartTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.flour, cls.milk, cls.salt = (
+            models.Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Молоко', 'Соль')
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.pancakes = self.create_recipe({self.flour: 200, self.milk: 500})
+        self.bread = self.create_recipe({self.flour: 300, self.salt: 5})
+
+    def create_recipe(self, amounts):
+        recipe = models.Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/images/recipe.png'
+        )
+        for ingredient, amount in amounts.items():
+            models.RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        return recipe
+
+    def get_totals(self, user=None):
+        return dict(
+            models.ShoppingListItem.objects
+            .filter(user=user or self.user)
+            .values_list('ingredient__name', 'amount')
+        )
+
+    def assert_totals(self, expected, user=None):
+        self.assertEqual(self.get_totals(user), expected)
+        self.assertEqual(cart.find_mismatches(), [])
+
+    def add_to_cart(self, *recipes, user=None):
+        for recipe in recipes:
+            models.ShoppingCartRecipe.objects.create(
+                user=user or self.user, recipe=recipe
+            )
+
+    def test_add_and_remove_cart_recipes(self):
+        self.add_to_cart(self.pancakes, self.bread)
+        self.assert_totals({'Мука': 500, 'Молоко': 500, 'Соль': 5})
+
+        models.ShoppingCartRecipe.objects.get(recipe=self.pancakes).delete()
+        self.assert_totals({'Мука': 300, 'Соль': 5})
+
+    def test_change_cart_row_recipe(self):
+        self.add_to_cart(self.pancakes)
+        row = models.ShoppingCartRecipe.objects.get()
+        row.recipe = self.bread
+        row.save()
+        self.assert_totals({'Мука': 300, 'Соль': 5})
+
+    def test_ingredient_line_edits(self):
+        self.add_to_cart(self.pancakes)
+        line = self.pancakes.recipe_ingredient.get(ingredient=self.milk)
+
+        line.amount = 250
+        line.save()
+        self.assert_totals({'Мука': 200, 'Молоко': 250})
+
+        line.ingredient = self.salt
+        line.save()
+        self.assert_totals({'Мука': 200, 'Соль': 250})
+
+        line.delete()
+        self.assert_totals({'Мука': 200})
+
+        models.RecipeIngredient.objects.create(
+            recipe=self.pancakes, ingredient=self.milk, amount=100
+        )
+        self.assert_totals({'Мука': 200, 'Молоко': 100})
+
+    def test_recipe_delete(self):
+        self.add_to_cart(self.pancakes, self.bread)
+        self.pancakes.delete()
+        self.assert_totals({'Мука': 300, 'Соль': 5})
+
+    def test_bulk_line_and_cart_deletes(self):
+        self.add_to_cart(self.pancakes, self.bread)
+        self.add_to_cart(self.pancakes, user=self.author)
+        models.RecipeIngredient.objects.filter(ingredient=self.flour).delete()
+        self.assert_totals({'Молоко': 500, 'Соль': 5})
+
+        models.ShoppingCartRecipe.objects.filter(
+            recipe=self.pancakes
+        ).delete()
+        self.assert_totals({'Соль': 5})
+        self.assert_totals({}, user=self.author)
+
+    def test_ingredient_delete(self):
+        self.add_to_cart(self.pancakes, self.bread)
+        self.flour.delete()
+        self.assert_totals({'Молоко': 500, 'Соль': 5})
+
+    def test_recipe_delete_query_count_ignores_carts_and_lines(self):
+        users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com', username=f'user{index}',
+                first_name='Иван', last_name='Иванов', password='password'
+            )
+            for index in range(3)
+        ]
+        for user in users:
+            self.add_to_cart(self.pancakes, self.bread, user=user)
+        small = self.create_recipe({self.salt: 1})
+        self.add_to_cart(small)
+
+        query_counts = []
+        for recipe in (small, self.pancakes):
+            with CaptureQueriesContext(connection) as context:
+                recipe.delete()
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assert_totals({'Мука': 300, 'Соль': 5}, user=users[0])
+        self.assertEqual(cart.find_mismatches(), [])
+
+    def test_author_delete(self):
+        self.add_to_cart(self.pancakes, self.bread)
+        self.add_to_cart(self.pancakes, user=self.author)
+        self.author.delete()
+        self.assert_totals({})
+
+    def test_cart_owner_delete(self):
+        self.add_to_cart(self.pancakes)
+        self.user.delete()
+        self.assertFalse(models.ShoppingListItem.objects.exists())
+
+    def test_cart_version_bumped_on_commit(self):
+        name = versions.cart(self.user.id)
+        version = versions.get_version(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_to_cart(self.pancakes)
+        self.assertNotEqual(versions.get_version(name), version)
+
+        version = versions.get_version(name)
+        line = self.pancakes.recipe_ingredient.get(ingredient=self.milk)
+        with self.captureOnCommitCallbacks(execute=True):
+            line.delete()
+        self.assertNotEqual(versions.get_version(name), version)
+
+
+class JobPruneTests(TestCase):
+    def create_job(self, status, age):
+        job = models.Job.objects.create(kind='test', status=status)
+        models.Job.objects.filter(pk=job.pk).update(
+            modified=timezone.now() - timedelta(seconds=age)
+        )
+        return job
+
+    def test_prunes_only_old_done_jobs(self):
+        retention = settings.JOB_DONE_RETENTION
+        self.create_job(models.Job.DONE, retention + 60)
+        kept = [
+            self.create_job(models.Job.DONE, 60).pk,
+            self.create_job(models.Job.FAILED, retention + 60).pk,
+        ]
+
+        call_command('run_jobs', stdout=StringIO())
+
+        self.assertEqual(
+            sorted(models.Job.objects.values_list('pk', flat=True)), kept
+        )
+
+    def test_stale_job_fails_after_max_attempts(self):
+        timeout = settings.JOB_TIMEOUT
+        exhausted = self.create_job(models.Job.RUNNING, timeout + 60)
+        retried = self.create_job(models.Job.RUNNING, timeout + 60)
+        models.Job.objects.filter(pk=exhausted.pk).update(
+            attempts=settings.JOB_MAX_ATTEMPTS
+        )
+        models.Job.objects.filter(pk=retried.pk).update(
+            attempts=settings.JOB_MAX_ATTEMPTS - 1
+        )
+
+        self.assertEqual(jobs.claim_job(), retried)
+        self.assertIsNone(jobs.claim_job())
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, models.Job.FAILED)
+        self.assertEqual(exhausted.attempts, settings.JOB_MAX_ATTEMPTS)
+
+
+@override_settings(PANTRY_INDEX_SYNC_OVERLAP=0)
+class PantryIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Пётр', last_name='Петров', password='password'
+        )
+        cls.flour, cls.milk, cls.salt, cls.eggs = (
+            models.Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Молоко', 'Соль', 'Яйца')
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.pancakes = self.create_recipe(self.flour, self.milk, self.eggs)
+        self.bread = self.create_recipe(self.flour, self.salt)
+        self.omelette = self.create_recipe(self.eggs, self.milk)
+        # Синхронизация должна находить изменения по modified, а не по
+        # тому, что все рецепты только что созданы.
+        models.Recipe.objects.update(
+            modified=timezone.now() - timedelta(hours=1)
+        )
+        self.index = PantryIndex()
+
+    def create_recipe(self, *ingredients):
+        recipe = models.Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/images/recipe.png'
+        )
+        models.RecipeIngredient.objects.bulk_create(
+            models.RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=100
+            )
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def search(self, ingredients, excluded=()):
+        return list(self.index.search(
+            [ingredient.id for ingredient in ingredients],
+            [ingredient.id for ingredient in excluded]
+        ))
+
+    def test_ranks_by_coverage(self):
+        self.assertEqual(self.search([self.flour, self.milk, self.eggs]), [
+            (self.pancakes.id, 3, 3),
+            (self.omelette.id, 2, 2),
+            (self.bread.id, 1, 2),
+        ])
+
+    def test_excluded_ingredients(self):
+        self.assertEqual(
+            self.search([self.flour], excluded=[self.eggs]),
+            [(self.bread.id, 1, 2)]
+        )
+
+    def test_syncs_ingredient_line_edits(self):
+        self.search([self.flour])
+
+        line = self.bread.recipe_ingredient.get(ingredient=self.salt)
+        line.ingredient = self.milk
+        with self.captureOnCommitCallbacks(execute=True):
+            line.save()
+        self.assertEqual(
+            self.search([self.flour, self.milk]),
+            [(self.bread.id, 2, 2), (self.pancakes.id, 2, 3),
+             (self.omelette.id, 1, 2)]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.recipe_ingredient.filter(
+                ingredient=self.eggs
+            ).delete()
+        self.assertEqual(
+            self.search([self.flour, self.milk]),
+            [(self.bread.id, 2, 2), (self.pancakes.id, 2, 2),
+             (self.omelette.id, 1, 2)]
+        )
+
+    def test_syncs_recipe_delete(self):
+        self.search([self.flour])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bread.delete()
+        self.assertEqual(
+            self.search([self.flour]), [(self.pancakes.id, 1, 3)]
+        )
+
+    def test_syncs_delete_with_create(self):
+        self.search([self.flour])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bread.delete()
+            self.create_recipe()
+        self.assertEqual(
+            self.search([self.flour]), [(self.pancakes.id, 1, 3)]
+        )
+
+    def test_recipe_without_lines_keeps_sync_incremental(self):
+        self.search([self.flour])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe()
+        # Удалённые рецепты, изменённые рецепты, их строки.
+        with self.assertNumQueries(3):
+            self.search([self.flour])
+
+    def test_rebuilds_after_deleted_retention(self):
+        self.search([self.flour])
+        models.DeletedRecipe.objects.create(
+            recipe_id=self.bread.id,
+            deleted=timezone.now() - timedelta(
+                seconds=settings.PANTRY_INDEX_DELETED_RETENTION + 60
+            )
+        )
+        self.index.synced_at -= timedelta(
+            seconds=settings.PANTRY_INDEX_DELETED_RETENTION
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bread.delete()
+        self.assertFalse(models.DeletedRecipe.objects.filter(
+            deleted__lt=timezone.now() - timedelta(
+                seconds=settings.PANTRY_INDEX_DELETED_RETENTION
+            )
+        ).exists())
+        self.assertEqual(
+            self.search([self.flour]), [(self.pancakes.id, 1, 3)]
+        )
+
+
+class TagMaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin',
+            first_name='Админ', last_name='Админов', password='password'
+        )
+        cls.breakfast, cls.lunch, cls.dinner = (
+            models.Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#E26C2D', 'breakfast'),
+                ('Обед', '#49B64E', 'lunch'),
+                ('Ужин', '#8775D2', 'dinner'),
+            )
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_recipe(self, *tags):
+        recipe = models.Recipe.objects.create(
+            author=self.admin, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/images/recipe.png',
+            tags_mask=sum(tag.mask for tag in tags)
+        )
+        models.RecipeTag.objects.bulk_create(
+            models.RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        return recipe
+
+    def assert_masks_match_tags(self):
+        for recipe in models.Recipe.objects.prefetch_related('tags'):
+            self.assertEqual(
+                recipe.tags_mask, sum(tag.mask for tag in recipe.tags.all())
+            )
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return context.captured_queries
+
+    def test_tag_delete_is_set_based(self):
+        self.create_recipe(self.breakfast, self.lunch)
+        few = len(self.count_queries(self.breakfast.delete))
+        for _ in range(5):
+            self.create_recipe(self.lunch, self.dinner)
+        many = len(self.count_queries(self.lunch.delete))
+
+        self.assertEqual(few, many)
+        self.assert_masks_match_tags()
+
+    def test_recipe_delete_skips_masks(self):
+        recipe = self.create_recipe(self.breakfast, self.lunch)
+        queries = self.count_queries(recipe.delete)
+        self.assertFalse([
+            query for query in queries if 'tags_mask' in query['sql']
+        ])
+
+    def test_recipe_tag_admin(self):
+        first = self.create_recipe(self.breakfast)
+        second = self.create_recipe(self.lunch)
+        recipe_tag = first.recipe_tag.get()
+
+        self.client.post(
+            f'/admin/app/recipetag/{recipe_tag.id}/change/',
+            {'recipe': second.id, 'tag': self.dinner.id}
+        )
+        self.assertEqual(
+            set(second.tags.all()), {self.lunch, self.dinner}
+        )
+        self.assert_masks_match_tags()
+
+        self.client.post(
+            f'/admin/app/recipetag/{recipe_tag.id}/delete/', {'post': 'yes'}
+        )
+        self.assert_masks_match_tags()
+
+    def test_recipe_admin_inline(self):
+        recipe = self.create_recipe(self.breakfast)
+        recipe_tag = recipe.recipe_tag.get()
+        response = self.client.post(
+            f'/admin/app/recipe/{recipe.id}/change/',
+            {
+                'name': recipe.name,
+                'author': self.admin.id,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'recipe_tag-TOTAL_FORMS': 2,
+                'recipe_tag-INITIAL_FORMS': 1,
+                'recipe_tag-0-id': recipe_tag.id,
+                'recipe_tag-0-recipe': recipe.id,
+                'recipe_tag-0-tag': self.breakfast.id,
+                'recipe_tag-0-DELETE': 'on',
+                'recipe_tag-1-recipe': recipe.id,
+                'recipe_tag-1-tag': self.dinner.id,
+                'recipe_ingredient-TOTAL_FORMS': 0,
+                'recipe_ingredient-INITIAL_FORMS': 0,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tags_mask, self.dinner.mask)
+
+
+@skipUnless(
+    connection.vendor == 'postgresql',
+    'SQLite не допускает параллельных пишущих транзакций.'
+)
+class ConcurrentCartTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Иван', last_name='Иванов', password='password'
+        )
+        flour = models.Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        self.recipes = [
+            models.Recipe.objects.create(
+                author=self.user, name='Рецепт', text='Описание',
+                cooking_time=10, image='recipes/images/recipe.png'
+            )
+            for _ in range(2)
+        ]
+        for recipe, amount in zip(self.recipes, (200, 300)):
+            models.RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=flour, amount=amount
+            )
+
+    def test_overlapping_adds_of_a_new_ingredient(self):
+        added, release = threading.Event(), threading.Event()
+        errors = []
+
+        def add_to_cart(recipe, hold):
+            try:
+                with transaction.atomic():
+                    models.ShoppingCartRecipe.objects.create(
+                        user=self.user, recipe=recipe
+                    )
+                    if hold:
+                        added.set()
+                        release.wait(5)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        first = threading.Thread(
+            target=add_to_cart, args=(self.recipes[0], True)
+        )
+        second = threading.Thread(
+            target=add_to_cart, args=(self.recipes[1], False)
+        )
+        first.start()
+        added.wait(5)
+        # Второе добавление начинается, пока первое не зафиксировано.
+        second.start()
+        second.join(0.5)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            list(models.ShoppingListItem.objects.values_list(
+                'amount', flat=True
+            )),
+            [500]
+        )
@@ -0,0 +1,36 @@
+import uuid
+
+from django.core.cache import cache
+
+INGREDIENTS = 'ingredients'
+TAGS = 'tags'
+SHOPPING_LISTS = 'shopping-lists'
+RECIPES = 'recipes'
+
+
+def cart(user_id):
+    return f'cart:{user_id}'
+
+
+def get_version(name):
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(*names):
+    keys = [f'version:{name}' for name in names]
+    stored = cache.get_many(keys)
+    return tuple(
+        stored.get(key) or get_version(name)
+        for key, name in zip(keys, names)
+    )
+
+
+def bump_version(*names):
+    cache.set_many(
+        {f'version:{name}': uuid.uuid4().hex for name in names}, None
+    )
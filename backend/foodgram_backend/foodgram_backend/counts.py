@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not (
+        query.where
+        or query.distinct
+        or query.combinator
+        or query.low_mark
+        or query.high_mark is not None
+    )
+
+
+def estimate_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+
+    if row is None or row[0] < settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+        return None
+    return row[0]
+
+
+def get_total_count(queryset):
+    if not is_unfiltered(queryset):
+        return queryset.count()
+
+    key = f'pagination-count:{queryset.model._meta.label_lower}'
+    count = cache.get(key)
+    if count is None:
+        count = estimate_count(queryset)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count
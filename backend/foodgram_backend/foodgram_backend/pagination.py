@@ -1,6 +1,204 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from foodgram_backend.counts import get_total_count
+
+
+def parse_positive_int(value, cutoff=None):
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    if cutoff:
+        return min(value, cutoff)
+    return value
+
+
+class CachedCountPaginator(DjangoPaginator):
+    @cached_property
+    def count(self):
+        return get_total_count(self.object_list)
 
 
 class PageNumberLimitPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу сортировки без OFFSET и COUNT(*).
+
+    Курсор хранит значения полей ``ordering`` крайней записи страницы,
+    последнее поле должно быть уникальным.
+    """
+    page_size = PageNumberLimitPagination.page_size
+    page_size_query_param = PageNumberLimitPagination.page_size_query_param
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('created', 'id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(queryset.model, request)
+
+        ordering = self.get_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_q(ordering, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return parse_positive_int(
+                request.query_params[self.page_size_query_param],
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith('-') else '-' + field
+            for field in self.ordering
+        )
+
+    @staticmethod
+    def get_keyset_q(ordering, position):
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(ordering[:index], position):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def get_position(self, instance):
+        return [
+            getattr(instance, field.lstrip('-')) for field in self.ordering
+        ]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps([position, reverse], default=str)
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, model, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+
+        try:
+            position, reverse = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            fields = [
+                model._meta.get_field(field.lstrip('-'))
+                for field in self.ordering
+            ]
+            if len(position) != len(fields):
+                raise ValueError
+            position = [
+                field.to_python(value)
+                for field, value in zip(fields, position)
+            ]
+        except (binascii.Error, DjangoValidationError,
+                TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, bool(reverse)
+
+
+class FeedPagination(KeysetPagination):
+    ordering = ('-created', '-id')
+
+
+class CursorOrPageNumberPagination(PageNumberLimitPagination):
+    """Номера страниц по умолчанию, курсор — если передан ``?cursor``.
+
+    Курсор задаёт свой порядок, поэтому с ранжированным поиском
+    (``ranked_query_params``) он не совмещается.
+    """
+    cursor_pagination_class = KeysetPagination
+    ranked_query_params = ('search',)
+    ranked_cursor_message = 'Курсор нельзя совмещать с поиском.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        cursor_param = self.cursor_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            if any(
+                request.query_params.get(param, '').strip()
+                for param in self.ranked_query_params
+            ):
+                raise ValidationError({
+                    cursor_param: self.ranked_cursor_message
+                })
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
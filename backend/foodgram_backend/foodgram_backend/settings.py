@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_filters',
     'rest_framework',
     'rest_framework.authtoken',
@@ -75,6 +76,18 @@ DATABASES = {
     }
 }
 
+# Cache
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/var/tmp/foodgram_cache'),
+    }
+}
+
 # Password validation
 
 AUTH_USER_MODEL = "users.User"
@@ -110,6 +123,26 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 5,
 }
 
+# Общее число записей для нефильтрованных списков берётся из кеша
+# и может отставать от реального не более чем на заданное время.
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+)
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', 100000)
+)
+
+INGREDIENT_SEARCH_LIMIT = 20
+# Порог схожести по триграммам: для индекса в памяти и для pg_trgm.
+INGREDIENT_FUZZY_THRESHOLD = 0.3
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+SHOPPING_LIST_CACHE_MAX_SIZE = 1024 * 1024
+# TrueType-шрифт с кириллицей, который встраивается в PDF списка покупок.
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 # Djoser settings
 
 DJOSER = {
@@ -146,4 +179,31 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+)
+
+# Фоновые задачи (manage.py run_jobs)
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_TIMEOUT = 10 * 60
+# Сколько секунд хранить выполненные задачи
+JOB_DONE_RETENTION = 7 * 24 * 60 * 60
+
+PANTRY_SEARCH_LIMIT = 20
+# Запас по времени при дочитывании изменённых рецептов в индекс
+# «из того, что есть»: покрывает расхождение часов и долгие транзакции.
+PANTRY_INDEX_SYNC_OVERLAP = 60
+# Сколько секунд хранить следы удалённых рецептов. Индекс, не
+# синхронизировавшийся дольше, перестраивается целиком.
+PANTRY_INDEX_DELETED_RETENTION = 24 * 60 * 60
+
+# Лента подписок: при подписке в неё попадают последние рецепты автора.
+FEED_BACKFILL_LIMIT = 500
+FEED_BATCH_SIZE = 1000
+
+# Массовый импорт рецептов
+RECIPE_IMPORT_BATCH_SIZE = 100
+RECIPE_IMPORT_MAX_ITEMS = 1000
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'